@@ -6,257 +6,372 @@ Helps diagnose and fix issues with compiled Python modules
 
 import sys
 import os
+import io
+import re
 import importlib.util
 from pathlib import Path
-import json
-import subprocess
-import platform
+from functools import lru_cache, partial
+
+# Default directory scanned when no module file is given
+_DEFAULT_BIN_DIR = str(Path.home() / '.nexus' / 'bin')
+
+# Section header rule
+_HR = "=" * 70
+
+# Directories already added to sys.path / PATH / the DLL search path
+_injected_dirs = set()
+
+# Specs of modules executed successfully, keyed by (file path, mtime_ns)
+_spec_cache = {}
+
+# Requirements-file comment: '#' at line start or after whitespace (pip's rule,
+# so URL fragments such as '#egg=' survive)
+_REQ_COMMENT_RE = re.compile(r'(?:^|\s+)#.*$')
+
+# ImportError classification: group 1 = DLL dependency issue, group 2 = missing package
+_ERR_RE = re.compile(
+    r'(dll load failed|specified module could not be found)'
+    r'|no module named [\'"]?([^\'"\s]+)',
+    re.I
+)
+
+
+@lru_cache(maxsize=None)
+def _scan_bin_dir(bin_dir: str) -> dict:
+    """List entry names in a binary directory once, so metadata probes are dict lookups
+
+    Keys are os.path.normcase'd (case-insensitive on Windows, like Path.exists());
+    values are the names as stored on disk.
+    """
+    try:
+        with os.scandir(bin_dir) as it:
+            return {os.path.normcase(entry.name): entry.name for entry in it}
+    except OSError:
+        return {}
+
+
+def _listed(names: dict, file: Path) -> bool:
+    """Check whether file is present in a _scan_bin_dir listing"""
+    return os.path.normcase(file.name) in names
+
+
+@lru_cache(maxsize=64)
+def _load_deps(deps_path: str, mtime_ns: int) -> list:
+    """Parse a .nexus.dependencies file (cached until its mtime changes)"""
+    import json
+    
+    return json.loads(Path(deps_path).read_bytes())
+
+
+@lru_cache(maxsize=1)
+def _platform_info() -> tuple:
+    """Return (platform string, architecture); probed once per process"""
+    import platform
+    
+    return platform.platform(), platform.architecture()
+
+
+def _section_buffer():
+    """Return a buffer and a print-like callable that writes into it"""
+    out = io.StringIO()
+    return out, partial(print, file=out)
+
+
+def _flush(out: io.StringIO):
+    """Write a section's buffered output with a single call and reset the buffer"""
+    sys.stdout.write(out.getvalue())
+    out.seek(0)
+    out.truncate()
 
 
 def check_python_version():
     """Check Python version"""
-    print("="*70)
-    print("PYTHON ENVIRONMENT")
-    print("="*70)
-    print(f"Python Version: {sys.version}")
-    print(f"Python Executable: {sys.executable}")
-    print(f"Platform: {platform.platform()}")
-    print(f"Architecture: {platform.architecture()}")
-    print()
+    platform_name, architecture = _platform_info()
+    out, emit = _section_buffer()
+    emit(_HR)
+    emit("PYTHON ENVIRONMENT")
+    emit(_HR)
+    emit(f"Python Version: {sys.version}")
+    emit(f"Python Executable: {sys.executable}")
+    emit(f"Platform: {platform_name}")
+    emit(f"Architecture: {architecture}")
+    emit()
+    
+    _flush(out)
 
 
-def check_module_file(pyd_file: Path):
+def check_module_file(pyd_file: Path, module_name: str, bin_dir: Path, names: dict):
     """Analyze a .pyd/.so file"""
-    print("="*70)
-    print(f"ANALYZING: {pyd_file.name}")
-    print("="*70)
-    print(f"File Path: {pyd_file}")
-    print(f"File Size: {pyd_file.stat().st_size / 1024:.2f} KB")
-    print(f"Exists: {pyd_file.exists()}")
-    print()
+    out, emit = _section_buffer()
+    emit(_HR)
+    emit(f"ANALYZING: {pyd_file.name}")
+    emit(_HR)
+    emit(f"File Path: {pyd_file}")
     
-    # Check for metadata files
-    base_name = pyd_file.stem.split('.')[0]
-    bin_dir = pyd_file.parent
+    # One stat call gives both existence and size
+    try:
+        st = pyd_file.stat()
+    except FileNotFoundError:
+        emit("Exists: False")
+        emit()
+        _flush(out)
+        return
+    
+    emit(f"File Size: {st.st_size / 1024:.2f} KB")
+    emit("Exists: True")
+    emit()
     
-    print("Metadata Files:")
+    # Check for metadata files
+    emit("Metadata Files:")
     metadata_files = {
-        'CLI API': bin_dir / f"{base_name}.nexus.cli",
-        'REST API': bin_dir / f"{base_name}.nexus.rest",
-        'Requirements': bin_dir / f"{base_name}.nexus.requirements",
-        'Dependencies': bin_dir / f"{base_name}.nexus.dependencies",
-        'Documentation': bin_dir / f"{base_name}.nexus.md",
+        'CLI API': bin_dir / f"{module_name}.nexus.cli",
+        'REST API': bin_dir / f"{module_name}.nexus.rest",
+        'Requirements': bin_dir / f"{module_name}.nexus.requirements",
+        'Dependencies': bin_dir / f"{module_name}.nexus.dependencies",
+        'Documentation': bin_dir / f"{module_name}.nexus.md",
     }
     
     for name, file in metadata_files.items():
-        status = "✓ Found" if file.exists() else "✗ Missing"
-        print(f"  {name}: {status}")
+        found = _listed(names, file)
+        status = "✓ Found" if found else "✗ Missing"
+        emit(f"  {name}: {status}")
         
-        if file.exists() and name == 'Requirements':
+        if found and name == 'Requirements':
             try:
-                with open(file, 'r') as f:
-                    reqs = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-                    if reqs:
-                        print(f"    Requirements found: {', '.join(reqs)}")
+                reqs = [
+                    req for line in file.read_text().splitlines()
+                    if (req := _REQ_COMMENT_RE.sub('', line).strip())
+                ]
+                if reqs:
+                    emit(f"    Requirements found: {', '.join(reqs)}")
             except:
                 pass
     
-    print()
+    emit()
+    
+    _flush(out)
 
 
-def test_direct_import(pyd_file: Path):
+def test_direct_import(pyd_file: Path, module_name: str, bin_dir: Path, names: dict):
     """Try to import the module directly and catch detailed errors"""
-    print("="*70)
-    print("ATTEMPTING DIRECT IMPORT")
-    print("="*70)
-    
-    module_name = pyd_file.stem.split('.')[0]
-    
-    # Add directory to path
-    bin_dir = str(pyd_file.parent.absolute())
-    if bin_dir not in sys.path:
-        sys.path.insert(0, bin_dir)
-    
-    # Add to PATH for DLL search
-    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
-    
-    # Try Windows DLL directory
-    if platform.system() == 'Windows' and hasattr(os, 'add_dll_directory'):
-        try:
-            os.add_dll_directory(bin_dir)
-            print(f"✓ Added DLL directory: {bin_dir}")
-        except Exception as e:
-            print(f"⚠ Could not add DLL directory: {e}")
-    
-    print(f"\nTrying to import: {module_name}")
-    print(f"From file: {pyd_file}\n")
+    out, emit = _section_buffer()
+    emit(_HR)
+    emit("ATTEMPTING DIRECT IMPORT")
+    emit(_HR)
     
-    try:
-        spec = importlib.util.spec_from_file_location(module_name, str(pyd_file))
-        if spec is None or spec.loader is None:
-            print("✗ FAILED: Could not create module spec")
-            return None
+    bin_path = str(bin_dir.absolute())
+    if bin_path not in _injected_dirs:
+        _injected_dirs.add(bin_path)
         
-        print("✓ Module spec created successfully")
+        # Add directory to path
+        if bin_path not in sys.path:
+            sys.path.insert(0, bin_path)
         
-        module = importlib.util.module_from_spec(spec)
-        sys.modules[module_name] = module
+        # Add to PATH for DLL search
+        os.environ['PATH'] = bin_path + os.pathsep + os.environ.get('PATH', '')
         
-        print("✓ Module object created successfully")
-        print("\n🔄 Executing module (loading dependencies)...\n")
+        # Try Windows DLL directory
+        if sys.platform == 'win32' and hasattr(os, 'add_dll_directory'):
+            try:
+                os.add_dll_directory(bin_path)
+                emit(f"✓ Added DLL directory: {bin_path}")
+            except Exception as e:
+                emit(f"⚠ Could not add DLL directory: {e}")
+    
+    emit(f"\nTrying to import: {module_name}")
+    emit(f"From file: {pyd_file}\n")
+    
+    try:
+        cache_key = (str(pyd_file), pyd_file.stat().st_mtime_ns)
+        spec = _spec_cache.get(cache_key)
+        module = sys.modules.get(module_name)
         
-        spec.loader.exec_module(module)
+        if spec is not None and module is not None and module.__spec__ is spec:
+            # Same file, unchanged since it was executed: reuse the loaded module
+            emit("✓ Module already loaded from this file (unchanged)")
+        else:
+            spec = importlib.util.spec_from_file_location(module_name, str(pyd_file))
+            if spec is None or spec.loader is None:
+                emit("✗ FAILED: Could not create module spec")
+                _flush(out)
+                return None
+            
+            emit("✓ Module spec created successfully")
+            
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            
+            emit("✓ Module object created successfully")
+            emit("\n🔄 Executing module (loading dependencies)...\n")
+            # Show progress before running module init, which may crash the process
+            _flush(out)
+            
+            spec.loader.exec_module(module)
+            _spec_cache[cache_key] = spec
         
-        print("✓ SUCCESS! Module loaded successfully")
-        print()
+        emit("✓ SUCCESS! Module loaded successfully")
+        emit()
         
         # List what's in the module
-        print("Module Contents:")
+        emit("Module Contents:")
         classes = []
         functions = []
         other = []
         
-        for name in dir(module):
-            if name.startswith('_'):
+        try:
+            members = sorted(vars(module).items())
+        except TypeError:
+            # No __dict__ to read from; fall back to attribute lookups
+            members = [(name, getattr(module, name, None)) for name in dir(module)]
+        
+        for name, obj in members:
+            if name[0] == '_':
                 continue
             
-            try:
-                obj = getattr(module, name)
-                if isinstance(obj, type):
-                    classes.append(name)
-                elif callable(obj):
-                    functions.append(name)
-                else:
-                    other.append(name)
-            except:
-                pass
+            # Exact-type test first: most classes use the default metaclass
+            if type(obj) is type or isinstance(obj, type):
+                classes.append(name)
+            elif callable(obj):
+                functions.append(name)
+            else:
+                other.append(name)
         
         if classes:
-            print(f"  Classes ({len(classes)}):")
+            emit(f"  Classes ({len(classes)}):")
             for cls in classes:
-                print(f"    • {cls}")
+                emit(f"    • {cls}")
         
         if functions:
-            print(f"  Functions ({len(functions)}):")
+            emit(f"  Functions ({len(functions)}):")
             for func in functions[:5]:
-                print(f"    • {func}")
+                emit(f"    • {func}")
             if len(functions) > 5:
-                print(f"    ... and {len(functions) - 5} more")
+                emit(f"    ... and {len(functions) - 5} more")
         
         if other:
-            print(f"  Other attributes ({len(other)}):")
+            emit(f"  Other attributes ({len(other)}):")
             for attr in other[:3]:
-                print(f"    • {attr}")
+                emit(f"    • {attr}")
         
+        _flush(out)
         return module
         
     except ImportError as e:
-        print(f"✗ IMPORT ERROR: {e}")
-        print()
+        emit(f"✗ IMPORT ERROR: {e}")
+        emit()
         
-        error_str = str(e).lower()
+        match = _ERR_RE.search(str(e))
         
-        if "dll load failed" in error_str or "specified module could not be found" in error_str:
-            print("🔍 This is a DLL dependency issue\n")
-            print("Possible causes:")
-            print("  1. Missing Python dependencies (packages not installed)")
-            print("  2. Missing system DLLs (Visual C++ Runtime)")
-            print("  3. Module compiled with different Python packages")
-            print()
-            print("💡 Solutions:")
-            print("  1. Check and install all requirements:")
+        if match and match.group(1):
+            emit("🔍 This is a DLL dependency issue\n")
+            emit("Possible causes:")
+            emit("  1. Missing Python dependencies (packages not installed)")
+            emit("  2. Missing system DLLs (Visual C++ Runtime)")
+            emit("  3. Module compiled with different Python packages")
+            emit()
+            emit("💡 Solutions:")
+            emit("  1. Check and install all requirements:")
             
-            req_file = pyd_file.parent / f"{module_name}.nexus.requirements"
-            if req_file.exists():
-                print(f"     pip install -r {req_file}")
+            req_file = bin_dir / f"{module_name}.nexus.requirements"
+            if _listed(names, req_file):
+                emit(f"     pip install -r {req_file}")
             
-            deps_file = pyd_file.parent / f"{module_name}.nexus.dependencies"
-            if deps_file.exists():
+            deps_file = bin_dir / f"{module_name}.nexus.dependencies"
+            if _listed(names, deps_file):
                 try:
-                    with open(deps_file, 'r') as f:
-                        deps = json.load(f)
-                        if deps:
-                            print(f"     pip install {' '.join(deps)}")
+                    deps = _load_deps(str(deps_file), deps_file.stat().st_mtime_ns)
+                    if deps:
+                        emit(f"     pip install {' '.join(deps)}")
                 except:
                     pass
             
-            print()
-            print("  2. Check that all dependencies are installed:")
-            print("     pip list")
-            print()
-            print("  3. Try reinstalling the module's dependencies")
+            emit()
+            emit("  2. Check that all dependencies are installed:")
+            emit("     pip list")
+            emit()
+            emit("  3. Try reinstalling the module's dependencies")
             
-        elif "no module named" in error_str:
-            missing_module = error_str.split("no module named")[1].strip().strip("'\"")
-            print(f"🔍 Missing Python package: {missing_module}\n")
-            print("💡 Solution:")
-            print(f"   pip install {missing_module}")
+        elif match:
+            missing_module = match.group(2)
+            emit(f"🔍 Missing Python package: {missing_module}\n")
+            emit("💡 Solution:")
+            emit(f"   pip install {missing_module}")
         
         else:
-            print("🔍 Unknown import error\n")
-            print("Try:")
-            print("  1. Reinstall all dependencies")
-            print("  2. Check Python version compatibility")
-            print("  3. Rebuild the module with correct environment")
+            emit("🔍 Unknown import error\n")
+            emit("Try:")
+            emit("  1. Reinstall all dependencies")
+            emit("  2. Check Python version compatibility")
+            emit("  3. Rebuild the module with correct environment")
         
+        _flush(out)
         return None
         
     except Exception as e:
-        print(f"✗ UNEXPECTED ERROR: {type(e).__name__}: {e}")
+        emit(f"✗ UNEXPECTED ERROR: {type(e).__name__}: {e}")
         import traceback
-        print()
-        print("Full traceback:")
+        emit()
+        emit("Full traceback:")
+        _flush(out)
         traceback.print_exc()
         return None
 
 
 def check_installed_packages():
     """Check what packages are installed"""
-    print("\n" + "="*70)
-    print("INSTALLED PACKAGES")
-    print("="*70)
+    from importlib.metadata import distributions
+    
+    out, emit = _section_buffer()
+    emit("\n" + _HR)
+    emit("INSTALLED PACKAGES")
+    emit(_HR)
     
     try:
-        result = subprocess.run(
-            [sys.executable, '-m', 'pip', 'list'],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
+        # Read installed distributions in-process instead of forking pip;
+        # the first match on sys.path wins, as with pip itself
+        packages = {}
+        for dist in distributions():
+            name = dist.metadata['Name']
+            if name and name.lower() not in packages:
+                packages[name.lower()] = (name, dist.version)
+        
+        rows = sorted(packages.values(), key=lambda row: row[0].lower())
+        width = max((len(name) for name, _ in rows[:20]), default=0)
         
-        lines = result.stdout.split('\n')
-        print("Installed packages:")
-        for line in lines[:20]:
-            print(f"  {line}")
+        emit("Installed packages:")
+        for name, version in rows[:20]:
+            emit(f"  {name:<{width}} {version}")
         
-        if len(lines) > 20:
-            print(f"  ... and {len(lines) - 20} more packages")
+        if len(rows) > 20:
+            emit(f"  ... and {len(rows) - 20} more packages")
         
     except Exception as e:
-        print(f"Could not list packages: {e}")
+        emit(f"Could not list packages: {e}")
+    
+    _flush(out)
 
 
-def suggest_fixes(module_name: str, bin_dir: Path):
+def suggest_fixes(module_name: str, bin_dir: Path, names: dict):
     """Suggest fixes based on available metadata"""
-    print("\n" + "="*70)
-    print("SUGGESTED FIXES")
-    print("="*70)
+    out, emit = _section_buffer()
+    emit("\n" + _HR)
+    emit("SUGGESTED FIXES")
+    emit(_HR)
     
     fixes = []
     
     # Check requirements file
     req_file = bin_dir / f"{module_name}.nexus.requirements"
-    if req_file.exists():
+    if _listed(names, req_file):
         fixes.append(f"1. Install requirements: pip install -r {req_file}")
     
     # Check dependencies file
     deps_file = bin_dir / f"{module_name}.nexus.dependencies"
-    if deps_file.exists():
+    if _listed(names, deps_file):
         try:
-            with open(deps_file, 'r') as f:
-                deps = json.load(f)
-                if deps:
-                    fixes.append(f"2. Install dependencies: pip install {' '.join(deps)}")
+            deps = _load_deps(str(deps_file), deps_file.stat().st_mtime_ns)
+            if deps:
+                fixes.append(f"2. Install dependencies: pip install {' '.join(deps)}")
         except:
             pass
     
@@ -274,7 +389,9 @@ def suggest_fixes(module_name: str, bin_dir: Path):
     fixes.append(f"   Look in: {bin_dir}")
     
     for fix in fixes:
-        print(fix)
+        emit(fix)
+    
+    _flush(out)
 
 
 def main():
@@ -284,7 +401,7 @@ def main():
     parser = argparse.ArgumentParser(description="Binary Module Diagnostic Tool")
     parser.add_argument('module_file', nargs='?', help='Path to .pyd or .so file')
     parser.add_argument('--bin-dir', help='Binary directory to scan', 
-                       default=str(Path.home() / '.nexus' / 'bin'))
+                       default=_DEFAULT_BIN_DIR)
     parser.add_argument('--list-packages', action='store_true', 
                        help='List installed packages')
     
@@ -294,7 +411,10 @@ def main():
     
     # Determine what to analyze
     if args.module_file:
-        pyd_file = Path(args.module_file)
+        pyd_files = [Path(args.module_file)]
+        if not pyd_files[0].exists():
+            print(f"Error: File not found: {pyd_files[0]}")
+            return
     else:
         # Scan bin directory
         bin_dir = Path(args.bin_dir)
@@ -302,8 +422,14 @@ def main():
             print(f"Error: Directory not found: {bin_dir}")
             return
         
-        # Find .pyd or .so files
-        pyd_files = list(bin_dir.glob('*.pyd')) + list(bin_dir.glob('*.so'))
+        # Find .pyd or .so files (shares the cached scan used for metadata probes);
+        # like Path.glob, match suffixes case-insensitively on Windows
+        listing = _scan_bin_dir(str(bin_dir.resolve()))
+        pyd_files = [
+            bin_dir / name
+            for key, name in sorted(listing.items(), key=lambda item: item[1])
+            if key.endswith(('.pyd', '.so'))
+        ]
         
         if not pyd_files:
             print(f"No .pyd or .so files found in: {bin_dir}")
@@ -313,31 +439,29 @@ def main():
         for f in pyd_files:
             print(f"  - {f.name}")
         print()
-        
-        # Use first one
-        pyd_file = pyd_files[0]
-        print(f"Analyzing first file: {pyd_file.name}\n")
-    
-    if not pyd_file.exists():
-        print(f"Error: File not found: {pyd_file}")
-        return
     
     # Run diagnostics
-    check_module_file(pyd_file)
-    module = test_direct_import(pyd_file)
+    for index, pyd_file in enumerate(pyd_files):
+        module_name = pyd_file.stem.partition('.')[0]
+        bin_dir = pyd_file.parent
+        names = _scan_bin_dir(str(bin_dir.resolve()))
+        
+        if index:
+            print()
+        check_module_file(pyd_file, module_name, bin_dir, names)
+        module = test_direct_import(pyd_file, module_name, bin_dir, names)
+        
+        # Suggest fixes if import failed
+        if module is None:
+            suggest_fixes(module_name, bin_dir, names)
+        else:
+            print("\n" + _HR)
+            print("✓ MODULE LOADED SUCCESSFULLY!")
+            print(_HR)
+            print("\nYou can now use this module with NexusLoader or import it directly.")
     
     if args.list_packages:
         check_installed_packages()
-    
-    # Suggest fixes if import failed
-    if module is None:
-        module_name = pyd_file.stem.split('.')[0]
-        suggest_fixes(module_name, pyd_file.parent)
-    else:
-        print("\n" + "="*70)
-        print("✓ MODULE LOADED SUCCESSFULLY!")
-        print("="*70)
-        print("\nYou can now use this module with NexusLoader or import it directly.")
 
 
 if __name__ == '__main__':